@@ -645,7 +645,7 @@ class Graphs(commands.Cog):
         colors = [rank.color_graph for rank in cf.RATED_RANKS]
 
         ratings = cf_common.cache2.rating_changes_cache.get_all_ratings()
-        ratings = np.array(sorted(ratings))
+        ratings = np.sort(ratings)
         n = len(ratings)
         perc = 100*np.arange(n)/n
 
@@ -1,9 +1,11 @@
 import asyncio
 import logging
 import time
+import numpy as np
 from aiocache import cached
 
 from collections import defaultdict
+from operator import attrgetter
 from discord.ext import commands
 
 from tle.util import codeforces_common as cf_common
@@ -15,11 +17,27 @@ from tle.util.ranklist import Ranklist
 
 logger = logging.getLogger(__name__)
 _CONTESTS_PER_BATCH_IN_CACHE_UPDATES = 100
+_CONCURRENT_FETCHES_IN_CACHE_UPDATES = 6
+# Contests without rating changes this long after they end are assumed to be unrated.
+_RATED_DELAY = 36 * 60 * 60
 CONTEST_BLACKLIST = {1308, 1309, 1431, 1432}
 
 def _is_blacklisted(contest):
     return contest.id in CONTEST_BLACKLIST
 
+
+async def _gather_bounded(coros, limit=_CONCURRENT_FETCHES_IN_CACHE_UPDATES):
+    """Await the coroutines concurrently, at most `limit` at a time, and return their results
+    in order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+
 class CacheError(commands.CommandError):
     pass
 
@@ -40,7 +58,7 @@ class ContestCache:
     _ACTIVE_CONTEST_RELOAD_DELAY = 5 * 60
     _ACTIVATE_BEFORE = 20 * 60
 
-    _RUNNING_PHASES = ('CODING', 'PENDING_SYSTEM_TEST', 'SYSTEM_TEST')
+    _RUNNING_PHASES = frozenset({'CODING', 'PENDING_SYSTEM_TEST', 'SYSTEM_TEST'})
 
     def __init__(self, cache_master):
         self.cache_master = cache_master
@@ -49,9 +67,13 @@ class ContestCache:
         self.contest_by_id = {}
         self.contests_by_phase = {phase: [] for phase in cf.Contest.PHASES}
         self.contests_by_phase['_RUNNING'] = []
+        self.contests_by_phase['_RECENTLY_FINISHED'] = []
         self.contests_last_cache = 0
 
         self.reload_lock = asyncio.Lock()
+        # Cleared while a reload is in progress.
+        self._reload_done = asyncio.Event()
+        self._reload_done.set()
         self.reload_exception = None
         self.next_delay = None
 
@@ -63,12 +85,9 @@ class ContestCache:
 
     async def reload_now(self):
         """Force a reload. If currently reloading it will wait until done."""
-        reloading = self.reload_lock.locked()
-        if reloading:
+        if not self._reload_done.is_set():
             # Wait until reload complete.
-            # To wait until lock is free, await acquire then release immediately.
-            async with self.reload_lock:
-                pass
+            await self._reload_done.wait()
         else:
             await self._update_task.manual_trigger()
 
@@ -88,18 +107,26 @@ class ContestCache:
         return self.contests_by_phase[phase]
 
     async def _try_disk(self):
-        async with self.reload_lock:
-            contests = self.cache_master.conn.fetch_contests()
-            if not contests:
-                self.logger.info('Contest cache on disk is empty.')
-                return
-            await self._update(contests, from_api=False)
+        self._reload_done.clear()
+        try:
+            async with self.reload_lock:
+                contests = self.cache_master.conn.fetch_contests()
+                if not contests:
+                    self.logger.info('Contest cache on disk is empty.')
+                    return
+                await self._update(contests, from_api=False)
+        finally:
+            self._reload_done.set()
 
     @tasks.task_spec(name='ContestCacheUpdate')
     async def _update_task(self, _):
-        async with self.reload_lock:
-            self.next_delay = await self._reload_contests()
-        self.reload_exception = None
+        self._reload_done.clear()
+        try:
+            async with self.reload_lock:
+                self.next_delay = await self._reload_contests()
+            self.reload_exception = None
+        finally:
+            self._reload_done.set()
 
     @_update_task.waiter()
     async def _update_task_waiter(self):
@@ -117,44 +144,53 @@ class ContestCache:
 
     async def _update(self, contests, from_api=True):
         self.logger.info(f'{len(contests)} contests fetched from {"API" if from_api else "disk"}')
-        contests.sort(key=lambda contest: (contest.startTimeSeconds, contest.id))
+        contests.sort(key=attrgetter('startTimeSeconds', 'id'))
 
         if from_api:
             rc = self.cache_master.conn.cache_contests(contests)
             self.logger.info(f'{rc} contests stored in database')
 
         contests_by_phase = {phase: [] for phase in cf.Contest.PHASES}
-        contests_by_phase['_RUNNING'] = []
+        running_contests = contests_by_phase['_RUNNING'] = []
         contest_by_id = {}
+        running_phases = self._RUNNING_PHASES
         for contest in contests:
-            contests_by_phase[contest.phase].append(contest)
+            phase = contest.phase
+            contests_by_phase[phase].append(contest)
             contest_by_id[contest.id] = contest
-            if contest.phase in self._RUNNING_PHASES:
-                contests_by_phase['_RUNNING'].append(contest)
+            if phase in running_phases:
+                running_contests.append(contest)
 
         now = time.time()
+        # Finished contests which may still be waiting for rating changes.
+        contests_by_phase['_RECENTLY_FINISHED'] = [
+            contest for contest in contests_by_phase['FINISHED']
+            if now - contest.end_time < _RATED_DELAY]
         delay = self._NORMAL_CONTEST_RELOAD_DELAY
+        activate_before = self._ACTIVATE_BEFORE
+        active_delay = self._ACTIVE_CONTEST_RELOAD_DELAY
 
         for contest in contests_by_phase['BEFORE']:
-            at = contest.startTimeSeconds - self._ACTIVATE_BEFORE
+            start = contest.startTimeSeconds
+            at = start - activate_before
             if at > now:
                 # Reload at _ACTIVATE_BEFORE before contest to monitor contest delays.
                 delay = min(delay, at - now)
             else:
                 # The contest starts in <= _ACTIVATE_BEFORE.
                 # Reload at contest start, or after _ACTIVE_CONTEST_RELOAD_DELAY, whichever comes first.
-                delay = min(contest.startTimeSeconds - now, self._ACTIVE_CONTEST_RELOAD_DELAY)
+                delay = min(start - now, active_delay)
 
-        if contests_by_phase['_RUNNING']:
+        if running_contests:
             # If any contest is running, reload at an increased rate to detect FINISHED
-            delay = min(delay, self._ACTIVE_CONTEST_RELOAD_DELAY)
+            delay = min(delay, active_delay)
 
         self.contests = contests
         self.contests_by_phase = contests_by_phase
         self.contest_by_id = contest_by_id
-        self.contests_last_cache = time.time()
+        self.contests_last_cache = now
 
-        cf_common.event_sys.dispatch(events.ContestListRefresh, self.contests.copy())
+        cf_common.event_sys.dispatch(events.ContestListRefresh, tuple(self.contests))
 
         return delay
 
@@ -168,8 +204,13 @@ class ProblemCache:
         self.problems = []
         self.problem_by_name = {}
         self.problems_last_cache = 0
+        # Hashable forms of the problems last stored in the database.
+        self._saved_problem_keys = set()
 
         self.reload_lock = asyncio.Lock()
+        # Cleared while a reload is in progress.
+        self._reload_done = asyncio.Event()
+        self._reload_done.set()
         self.reload_exception = None
 
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -180,12 +221,9 @@ class ProblemCache:
 
     async def reload_now(self):
         """Force a reload. If currently reloading it will wait until done."""
-        reloading = self.reload_lock.locked()
-        if reloading:
+        if not self._reload_done.is_set():
             # Wait until reload complete.
-            # To wait until lock is free, await acquire then release immediately.
-            async with self.reload_lock:
-                pass
+            await self._reload_done.wait()
         else:
             await self._update_task.manual_trigger()
 
@@ -193,21 +231,30 @@ class ProblemCache:
             raise self.reload_exception
 
     async def _try_disk(self):
-        async with self.reload_lock:
-            problems = self.cache_master.conn.fetch_problems()
-            if not problems:
-                self.logger.info('Problem cache on disk is empty.')
-                return
-            self.problems = problems
-            self.problem_by_name = {problem.name: problem for problem in problems}
-            self.logger.info(f'{len(self.problems)} problems fetched from disk')
+        self._reload_done.clear()
+        try:
+            async with self.reload_lock:
+                problems = self.cache_master.conn.fetch_problems()
+                if not problems:
+                    self.logger.info('Problem cache on disk is empty.')
+                    return
+                self.problems = problems
+                self.problem_by_name = dict(zip(map(attrgetter('name'), problems), problems))
+                self._saved_problem_keys = set(map(self._problem_key, problems))
+                self.logger.info(f'{len(self.problems)} problems fetched from disk')
+        finally:
+            self._reload_done.set()
 
     @tasks.task_spec(name='ProblemCacheUpdate',
                      waiter=tasks.Waiter.fixed_delay(_RELOAD_INTERVAL))
     async def _update_task(self, _):
-        async with self.reload_lock:
-            await self._reload_problems()
-        self.reload_exception = None
+        self._reload_done.clear()
+        try:
+            async with self.reload_lock:
+                await self._reload_problems()
+            self.reload_exception = None
+        finally:
+            self._reload_done.set()
 
     @_update_task.exception_handler()
     async def _update_task_exception_handler(self, ex):
@@ -217,27 +264,32 @@ class ProblemCache:
         problems, _ = await cf.problemset.problems()
         await self._update(problems)
 
+    @staticmethod
+    def _problem_key(problem):
+        return problem._replace(tags=tuple(problem.tags))
+
     async def _update(self, problems):
         self.logger.info(f'{len(problems)} problems fetched from API')
-        contest_map = {problem.contestId: self.cache_master.contest_cache.contest_by_id.get(problem.contestId)
-                       for problem in problems}
-
-        def keep(problem):
-            return (contest_map[problem.contestId] and
-                    problem.has_metadata())
-
-        filtered_problems = list(filter(keep, problems))
-        problem_by_name = {
-            problem.name: problem  # This will discard some valid problems
-            for problem in filtered_problems
-        }
+        contest_by_id = self.cache_master.contest_cache.contest_by_id
+        filtered_problems = [problem for problem in problems
+                             if problem.has_metadata() and contest_by_id.get(problem.contestId)]
+        # This will discard some valid problems
+        problem_by_name = dict(zip(map(attrgetter('name'), filtered_problems), filtered_problems))
         self.logger.info(f'Keeping {len(problem_by_name)} problems')
 
         self.problems = list(problem_by_name.values())
         self.problem_by_name = problem_by_name
         self.problems_last_cache = time.time()
 
-        rc = self.cache_master.conn.cache_problems(self.problems)
+        keys = set(map(self._problem_key, self.problems))
+        if keys == self._saved_problem_keys:
+            self.logger.info('Problems unchanged, database not updated')
+            return
+        changed = [problem for problem in self.problems
+                   if self._problem_key(problem) not in self._saved_problem_keys]
+        with self.cache_master.conn.transaction():
+            rc = self.cache_master.conn.cache_problems(changed)
+        self._saved_problem_keys = keys
         self.logger.info(f'{rc} problems stored in database')
 
 
@@ -273,8 +325,9 @@ class ProblemsetCache:
         async with self.update_lock:
             contest = self.cache_master.contest_cache.get_contest(contest_id)
             problemset, _ = await self._fetch_problemsets([contest], force_fetch=True)
-            self.cache_master.conn.clear_problemset(contest_id)
-            self._save_problems(problemset)
+            with self.cache_master.conn.transaction():
+                self.cache_master.conn.clear_problemset(contest_id)
+                self._save_problems(problemset)
             return len(problemset)
 
     async def update_for_all(self):
@@ -282,8 +335,9 @@ class ProblemsetCache:
         async with self.update_lock:
             contests = self.cache_master.contest_cache.contests_by_phase['FINISHED']
             problemsets, _ = await self._fetch_problemsets(contests, force_fetch=True)
-            self.cache_master.conn.clear_problemset()
-            self._save_problems(problemsets)
+            with self.cache_master.conn.transaction():
+                self.cache_master.conn.clear_problemset()
+                self._save_problems(problemsets)
             return len(problemsets)
 
     @tasks.task_spec(name='ProblemsetCacheUpdate',
@@ -292,7 +346,9 @@ class ProblemsetCache:
         async with self.update_lock:
             contests = self.cache_master.contest_cache.contests_by_phase['FINISHED']
             new_problems, updated_problems = await self._fetch_problemsets(contests)
-            self._save_problems(new_problems + updated_problems)
+            with self.cache_master.conn.transaction():
+                self._save_problems(new_problems)
+                self._save_problems(updated_problems)
             self._update_from_disk()
             self.logger.info(f'{len(new_problems)} new problems saved and {len(updated_problems)} '
                              'saved problems updated.')
@@ -306,11 +362,13 @@ class ProblemsetCache:
             new_contest_ids = [contest.id for contest in contests]
         else:
             now = time.time()
+            # Contests too old are not checked.
+            contests = [contest for contest in contests
+                        if now <= contest.end_time + self._MONITOR_PERIOD_SINCE_CONTEST_END]
+            problemset_by_contest = self.cache_master.conn.fetch_problemsets(
+                contest.id for contest in contests)
             for contest in contests:
-                if now > contest.end_time + self._MONITOR_PERIOD_SINCE_CONTEST_END:
-                    # Contest too old, we do not want to check it.
-                    continue
-                problemset = self.cache_master.conn.fetch_problemset(contest.id)
+                problemset = problemset_by_contest.get(contest.id)
                 if not problemset:
                     new_contest_ids.append(contest.id)
                     continue
@@ -318,11 +376,16 @@ class ProblemsetCache:
                 if len(rated_problem_idx) < len(problemset):
                     contests_to_refetch.append((contest.id, rated_problem_idx))
 
+        new_problemsets = await _gather_bounded(
+            self._fetch_for_contest(contest_id) for contest_id in new_contest_ids)
+        refetched_problemsets = await _gather_bounded(
+            self._fetch_for_contest(contest_id) for contest_id, _ in contests_to_refetch)
+
         new_problems, updated_problems = [], []
-        for contest_id in new_contest_ids:
-            new_problems += await self._fetch_for_contest(contest_id)
-        for contest_id, rated_problem_idx in contests_to_refetch:
-            updated_problems += [prob for prob in await self._fetch_for_contest(contest_id)
+        for problemset in new_problemsets:
+            new_problems += problemset
+        for (_, rated_problem_idx), problemset in zip(contests_to_refetch, refetched_problemsets):
+            updated_problems += [prob for prob in problemset
                                  if prob.rating is not None and prob.index not in rated_problem_idx]
 
         return new_problems, updated_problems
@@ -359,18 +422,21 @@ class ProblemsetCache:
 
 
 class RatingChangesCache:
-    _RATED_DELAY = 36 * 60 * 60
+    _RATED_DELAY = _RATED_DELAY
     _RELOAD_DELAY = 10 * 60
 
     def __init__(self, cache_master):
         self.cache_master = cache_master
         self.monitored_contests = []
-        self.handle_rating_cache = {}
+        # Current ratings are stored as an array, indexed through handle_idx.
+        self.handle_idx = {}
+        self.ratings = np.zeros(0, dtype=np.int32)
+        self.last_rating_update_time = 0
         self.logger = logging.getLogger(self.__class__.__name__)
 
     async def run(self):
         self._refresh_handle_cache()
-        if not self.handle_rating_cache:
+        if not self.handle_idx:
             self.logger.warning('Rating changes cache on disk is empty. This must be populated '
                                 'manually before use.')
         self._update_task.start()
@@ -392,8 +458,8 @@ class RatingChangesCache:
         """Fetch rating changes for contests which are not saved in database. Intended for
         manual trigger."""
         contests = self.cache_master.contest_cache.contests_by_phase['FINISHED']
-        contests = [
-            contest for contest in contests if not self.has_rating_changes_saved(contest.id)]
+        saved = self.contests_with_rating_changes_saved(contest.id for contest in contests)
+        contests = [contest for contest in contests if contest.id not in saved]
         total_changes = 0
         for contests_chunk in paginator.chunkify(contests, _CONTESTS_PER_BATCH_IN_CACHE_UPDATES):
             contests_chunk = await self._fetch(contests_chunk)
@@ -401,12 +467,24 @@ class RatingChangesCache:
             total_changes += len(contests_chunk)
         return total_changes
 
-    def is_newly_finished_without_rating_changes(self, contest):
-        now = time.time()
+    def is_newly_finished_without_rating_changes(self, contest, now=None):
+        if now is None:
+            now = time.time()
         return (contest.phase == 'FINISHED' and
                 now - contest.end_time < self._RATED_DELAY and
                 not self.has_rating_changes_saved(contest.id))
 
+    def newly_finished_contests_without_rating_changes(self):
+        """Returns the recently finished, non-blacklisted contests without saved rating changes,
+        checking the database once for all of them."""
+        contests = [
+            contest for contest in
+            self.cache_master.contest_cache.contests_by_phase['_RECENTLY_FINISHED']
+            if not _is_blacklisted(contest)
+        ]
+        saved = self.contests_with_rating_changes_saved(contest.id for contest in contests)
+        return [contest for contest in contests if contest.id not in saved]
+
     @tasks.task_spec(name='RatingChangesCacheUpdate',
                      waiter=tasks.Waiter.for_event(events.ContestListRefresh))
     async def _update_task(self, _):
@@ -417,13 +495,7 @@ class RatingChangesCache:
         # A contest also has empty list if it is unrated. We assume that is the case if
         # _RATED_DELAY time has passed since the contest end.
 
-        to_monitor = [
-            contest for contest in
-            self.cache_master.contest_cache.contests_by_phase['FINISHED'] 
-            if self.is_newly_finished_without_rating_changes(contest)
-            and not _is_blacklisted(contest)
-            ]
-                 
+        to_monitor = self.newly_finished_contests_without_rating_changes()
         cur_ids = {contest.id for contest in self.monitored_contests}
         new_ids = {contest.id for contest in to_monitor}
         if new_ids != cur_ids:
@@ -437,9 +509,10 @@ class RatingChangesCache:
     @tasks.task_spec(name='RatingChangesCacheUpdate.MonitorNewlyFinishedContests',
                      waiter=tasks.Waiter.fixed_delay(_RELOAD_DELAY))
     async def _monitor_task(self, _):
+        now = time.time()
         self.monitored_contests = [
             contest for contest in self.monitored_contests
-            if self.is_newly_finished_without_rating_changes(contest)
+            if self.is_newly_finished_without_rating_changes(contest, now)
             and not _is_blacklisted(contest)
         ]
 
@@ -458,33 +531,70 @@ class RatingChangesCache:
                                          rating_changes=changes)
 
     async def _fetch(self, contests):
-        all_changes = []
-        for contest in contests:
+        async def fetch(contest):
             try:
                 changes = await cf.contest.ratingChanges(contest_id=contest.id)
                 self.logger.info(f'{len(changes)} rating changes fetched for contest {contest.id}')
-                if changes:
-                    all_changes.append((contest, changes))
+                return changes
             except cf.CodeforcesApiError as er:
                 self.logger.warning(f'Fetch rating changes failed for contest {contest.id}, ignoring. {er!r}')
-                pass
-        return all_changes
+                return None
+
+        results = await _gather_bounded(fetch(contest) for contest in contests)
+        return [(contest, changes) for contest, changes in zip(contests, results) if changes]
 
     def _save_changes(self, contest_changes_pairs):
         flattened = [change for _, changes in contest_changes_pairs for change in changes]
         if not flattened:
             return
-        rc = self.cache_master.conn.save_rating_changes(flattened)
+        with self.cache_master.conn.transaction():
+            rc = self.cache_master.conn.save_rating_changes(flattened)
         self.logger.info(f'Saved {rc} changes to database.')
-        self._refresh_handle_cache()
+        self._apply_to_handle_cache(flattened)
 
     def _refresh_handle_cache(self):
-        changes = self.cache_master.conn.get_all_rating_changes()
-        handle_rating_cache = {}
-        for change in changes:
-            handle_rating_cache[change.handle] = change.newRating
-        self.handle_rating_cache = handle_rating_cache
-        self.logger.info(f'Ratings for {len(handle_rating_cache)} handles cached')
+        changes = self.cache_master.conn.iter_all_rating_changes()
+        # Changes are ordered by update time, so the last one seen for a handle is the latest.
+        rating_by_handle = {}
+        last_update_time = 0
+        for handle, update_time, new_rating in changes:
+            rating_by_handle[handle] = new_rating
+            last_update_time = update_time
+        self.handle_idx = {handle: idx for idx, handle in enumerate(rating_by_handle)}
+        self.ratings = np.fromiter(rating_by_handle.values(), dtype=np.int32,
+                                   count=len(rating_by_handle))
+        self.last_rating_update_time = last_update_time
+        self.logger.info(f'Ratings for {len(rating_by_handle)} handles cached')
+
+    def _apply_to_handle_cache(self, changes):
+        """Updates the handle cache with newly saved changes. If any of them is not newer than
+        the latest change already cached, as when refetching a contest, the cache is rebuilt
+        from the database instead."""
+        changes = sorted(changes, key=lambda change: change.ratingUpdateTimeSeconds)
+        # Changes at the latest cached time may be a refetch of a contest already cached, which can
+        # drop handles, so those need a rebuild too.
+        if changes[0].ratingUpdateTimeSeconds <= self.last_rating_update_time:
+            self._refresh_handle_cache()
+            return
+
+        rating_by_handle = {change.handle: change.newRating for change in changes}
+        handle_idx = self.handle_idx
+        updated_idx, updated_ratings, new_ratings = [], [], []
+        for handle, rating in rating_by_handle.items():
+            idx = handle_idx.get(handle)
+            if idx is None:
+                handle_idx[handle] = len(handle_idx)
+                new_ratings.append(rating)
+            else:
+                updated_idx.append(idx)
+                updated_ratings.append(rating)
+        # np.append makes a new array, so arrays handed out by get_all_ratings are not modified.
+        ratings = np.append(self.ratings, np.array(new_ratings, dtype=np.int32))
+        ratings[updated_idx] = updated_ratings
+        self.ratings = ratings
+        self.last_rating_update_time = changes[-1].ratingUpdateTimeSeconds
+        self.logger.info(f'Ratings for {len(rating_by_handle)} handles updated, '
+                         f'{len(new_ratings)} new')
 
     def get_users_with_more_than_n_contests(self, time_cutoff, n):
         return self.cache_master.conn.get_users_with_more_than_n_contests(time_cutoff, n)
@@ -495,15 +605,22 @@ class RatingChangesCache:
     def has_rating_changes_saved(self, contest_id):
         return self.cache_master.conn.has_rating_changes_saved(contest_id)
 
+    def contests_with_rating_changes_saved(self, contest_ids):
+        return self.cache_master.conn.contests_with_rating_changes_saved(contest_ids)
+
     def get_rating_changes_for_handle(self, handle):
         return self.cache_master.conn.get_rating_changes_for_handle(handle)
 
     def get_current_rating(self, handle, default_if_absent=False):
-        return self.handle_rating_cache.get(handle,
-                                            cf.DEFAULT_RATING if default_if_absent else None)
+        idx = self.handle_idx.get(handle)
+        if idx is None:
+            return cf.DEFAULT_RATING if default_if_absent else None
+        return int(self.ratings[idx])
 
     def get_all_ratings(self):
-        return list(self.handle_rating_cache.values())
+        """Returns a numpy array of the current ratings of all cached handles. The array must
+        not be modified."""
+        return self.ratings
 
 
 class RanklistCacheError(CacheError):
@@ -522,6 +639,7 @@ class RanklistCache:
         self.cache_master = cache_master
         self.monitored_contests = []
         self.ranklist_by_contest = {}
+        self.effective_rating_lock = asyncio.Lock()
         self.logger = logging.getLogger(self.__class__.__name__)
 
     async def run(self):
@@ -540,11 +658,7 @@ class RanklistCache:
         running_contests = contests_by_phase['_RUNNING']
 
         rating_cache = self.cache_master.rating_changes_cache
-        finished_contests = [
-            contest for contest in contests_by_phase['FINISHED']
-            if not _is_blacklisted(contest)
-            and rating_cache.is_newly_finished_without_rating_changes(contest)
-        ]
+        finished_contests = rating_cache.newly_finished_contests_without_rating_changes()
 
         to_monitor = running_contests + finished_contests
         cur_ids = {contest.id for contest in self.monitored_contests}
@@ -561,11 +675,12 @@ class RanklistCache:
                      waiter=tasks.Waiter.fixed_delay(_RELOAD_DELAY))
     async def _monitor_task(self, _):
         cache = self.cache_master.rating_changes_cache
+        now = time.time()
         self.monitored_contests = [
             contest for contest in self.monitored_contests
             if not _is_blacklisted(contest) and (
                 contest.phase != 'FINISHED'
-                or cache.is_newly_finished_without_rating_changes(contest))
+                or cache.is_newly_finished_without_rating_changes(contest, now))
         ]
 
         if not self.monitored_contests:
@@ -607,14 +722,20 @@ class RanklistCache:
         elif predict_changes:
             # Rating changes have not been applied yet, predict rating changes.
             # For running/recent contests.
-            _, _, standings_official = await cf.contest.standings(contest_id=contest_id)
+            # The official standings are the CONTESTANT rows of the unofficial ones, so they are
+            # filtered here instead of being requested again.
+            standings_official = [row for row in standings
+                                  if row.party.participantType == 'CONTESTANT']
 
             has_teams = any(row.party.teamId is not None for row in standings_official)
             if cf_common.is_nonstandard_contest(contest) or has_teams:
                 # The contest is not rated
                 ranklist = Ranklist(contest, problems, standings, now, is_rated=False)
             else:
-                current_rating = await CacheSystem.getUsersEffectiveRating(activeOnly=False)
+                # Ranklists are fetched concurrently. Serialize this so that only the first
+                # caller downloads the rated list and the rest hit the cache.
+                async with self.effective_rating_lock:
+                    current_rating = await CacheSystem.getUsersEffectiveRating(activeOnly=False)
                 current_rating = {row.party.members[0].handle: current_rating.get(row.party.members[0].handle, 1500)
                                   for row in standings_official}
                 if 'Educational' in contest.name:
@@ -660,16 +781,18 @@ class RanklistCache:
         return ranklist
 
     async def _fetch(self, contests):
-        ranklist_by_contest = {}
-        for contest in contests:
+        async def fetch(contest):
             try:
                 ranklist = await self.generate_ranklist(contest.id, predict_changes=True)
-                ranklist_by_contest[contest.id] = ranklist
                 self.logger.info(f'Ranklist fetched for contest {contest.id}')
+                return ranklist
             except cf.CodeforcesApiError as er:
                 self.logger.warning(f'Ranklist fetch failed for contest {contest.id}. {er!r}')
+                return None
 
-        return ranklist_by_contest
+        ranklists = await _gather_bounded(fetch(contest) for contest in contests)
+        return {contest.id: ranklist for contest, ranklist in zip(contests, ranklists)
+                if ranklist is not None}
 
 
 class CacheSystem:
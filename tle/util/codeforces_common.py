@@ -103,8 +103,14 @@ _NONSTANDARD_CONTEST_INDICATORS = [
     'marathon', 'kotlin', 'onsite', 'experimental', 'abbyy']
 
 
+@functools.lru_cache(maxsize=4096)
+def _is_nonstandard_contest_name(name):
+    name = name.lower()
+    return any(string in name for string in _NONSTANDARD_CONTEST_INDICATORS)
+
+
 def is_nonstandard_contest(contest):
-    return any(string in contest.name.lower() for string in _NONSTANDARD_CONTEST_INDICATORS)
+    return _is_nonstandard_contest_name(contest.name)
 
 def is_nonstandard_problem(problem):
     return (is_nonstandard_contest(cache2.contest_cache.get_contest(problem.contestId)) or
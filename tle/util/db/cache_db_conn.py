@@ -1,14 +1,31 @@
+import contextlib
 import json
 import sqlite3
+from collections import defaultdict
 
 from tle.util import codeforces_api as cf
 
+# Stay below SQLITE_MAX_VARIABLE_NUMBER, which is 999 on older sqlite versions.
+_MAX_QUERY_PARAMS = 500
+
 
 class CacheDbConn:
     def __init__(self, db_file):
         self.conn = sqlite3.connect(db_file)
+        self._in_transaction = False
+        self.configure()
         self.create_tables()
 
+    def configure(self):
+        # WAL lets the caches read while a refresh is writing. Note that in WAL mode sqlite keeps
+        # `-wal` and `-shm` files next to the database file, these must be kept together with it.
+        self.conn.executescript(
+            'PRAGMA journal_mode = WAL;'
+            'PRAGMA synchronous = NORMAL;'
+            'PRAGMA temp_store = MEMORY;'
+            'PRAGMA mmap_size = 268435456;'
+        )
+
     def create_tables(self):
         # Table for contests from the contest.list endpoint.
         self.conn.execute(
@@ -55,6 +72,9 @@ class CacheDbConn:
                           'ON rating_change (contest_id)')
         self.conn.execute('CREATE INDEX IF NOT EXISTS ix_rating_change_handle '
                           'ON rating_change (handle)')
+        # Covers the ordered scan that rebuilds the handle rating cache.
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ix_rating_change_update_time '
+                          'ON rating_change (rating_update_time, handle, new_rating)')
 
         # Table for problems fetched from contest.standings endpoint for every contest.
         # This is separate from table problem as it contains the same problem twice if it
@@ -75,12 +95,36 @@ class CacheDbConn:
         self.conn.execute('CREATE INDEX IF NOT EXISTS ix_problem2_contest_id '
                           'ON problem2 (contest_id)')
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group the writes made inside the block into a single transaction, committed once on
+        exit and rolled back on error. Nested uses join the outermost transaction."""
+        if self._in_transaction:
+            yield
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        self._in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self._in_transaction = False
+
+    def _commit(self):
+        # Inside transaction() the commit is deferred to the end of the block.
+        if not self._in_transaction:
+            self.conn.commit()
+
     def cache_contests(self, contests):
         query = ('INSERT OR REPLACE INTO contest '
                  '(id, name, start_time, duration, type, phase, prepared_by) '
                  'VALUES (?, ?, ?, ?, ?, ?, ?)')
         rc = self.conn.executemany(query, contests).rowcount
-        self.conn.commit()
+        self._commit()
         return rc
 
     def fetch_contests(self):
@@ -99,7 +143,7 @@ class CacheDbConn:
                  '(contest_id, problemset_name, [index], name, type, points, rating, tags) '
                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
         rc = self.conn.executemany(query, list(map(self._squish_tags, problems))).rowcount
-        self.conn.commit()
+        self._commit()
         return rc
 
     @staticmethod
@@ -124,7 +168,7 @@ class CacheDbConn:
                  '(contest_id, handle, rank, rating_update_time, old_rating, new_rating) '
                  'VALUES (?, ?, ?, ?, ?, ?)')
         rc = self.conn.executemany(query, change_tuples).rowcount
-        self.conn.commit()
+        self._commit()
         return rc
 
     def clear_rating_changes(self, contest_id=None):
@@ -134,7 +178,7 @@ class CacheDbConn:
         else:
             query = 'DELETE FROM rating_change WHERE contest_id = ?'
             self.conn.execute(query, (contest_id,))
-        self.conn.commit()
+        self._commit()
 
     def get_users_with_more_than_n_contests(self, time_cutoff, n):
         query = ('SELECT handle, COUNT(*) AS num_contests '
@@ -143,14 +187,13 @@ class CacheDbConn:
         res = self.conn.execute(query, (n, time_cutoff,)).fetchall()
         return [user[0] for user in res]
 
-    def get_all_rating_changes(self):
-        query = ('SELECT contest_id, name, handle, rank, rating_update_time, old_rating, new_rating '
-                 'FROM rating_change r '
-                 'LEFT JOIN contest c '
-                 'ON r.contest_id = c.id '
+    def iter_all_rating_changes(self):
+        """Yields (handle, rating_update_time, new_rating) rows for all rating changes ordered by
+        update time, straight from the cursor."""
+        query = ('SELECT handle, rating_update_time, new_rating '
+                 'FROM rating_change '
                  'ORDER BY rating_update_time')
-        res = self.conn.execute(query)
-        return (cf.RatingChange._make(change) for change in res)
+        return self.conn.execute(query)
 
     def get_rating_changes_for_contest(self, contest_id):
         query = ('SELECT contest_id, name, handle, rank, rating_update_time, old_rating, new_rating '
@@ -168,6 +211,18 @@ class CacheDbConn:
         res = self.conn.execute(query, (contest_id,)).fetchone()
         return res is not None
 
+    def contests_with_rating_changes_saved(self, contest_ids):
+        """Returns the set of ids among `contest_ids` which have rating changes saved."""
+        contest_ids = list(contest_ids)
+        saved = set()
+        for i in range(0, len(contest_ids), _MAX_QUERY_PARAMS):
+            chunk = contest_ids[i:i + _MAX_QUERY_PARAMS]
+            query = ('SELECT DISTINCT contest_id '
+                     'FROM rating_change '
+                     f'WHERE contest_id IN ({", ".join("?" * len(chunk))})')
+            saved.update(row[0] for row in self.conn.execute(query, chunk))
+        return saved
+
     def get_rating_changes_for_handle(self, handle):
         query = ('SELECT contest_id, name, handle, rank, rating_update_time, old_rating, new_rating '
                  'FROM rating_change r '
@@ -182,7 +237,7 @@ class CacheDbConn:
                  '(contest_id, problemset_name, [index], name, type, points, rating, tags) '
                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
         rc = self.conn.executemany(query, list(map(self._squish_tags, problemset))).rowcount
-        self.conn.commit()
+        self._commit()
         return rc
 
     def fetch_problems2(self):
@@ -206,6 +261,20 @@ class CacheDbConn:
         res = self.conn.execute(query, (contest_id,)).fetchall()
         return list(map(self._unsquish_tags, res))
 
+    def fetch_problemsets(self, contest_ids):
+        """Returns a dict mapping each id among `contest_ids` which has a saved problemset to
+        the list of its problems."""
+        contest_ids = list(contest_ids)
+        problemset_by_contest = defaultdict(list)
+        for i in range(0, len(contest_ids), _MAX_QUERY_PARAMS):
+            chunk = contest_ids[i:i + _MAX_QUERY_PARAMS]
+            query = ('SELECT contest_id, problemset_name, [index], name, type, points, rating, tags '
+                     'FROM problem2 '
+                     f'WHERE contest_id IN ({", ".join("?" * len(chunk))})')
+            for problem in map(self._unsquish_tags, self.conn.execute(query, chunk)):
+                problemset_by_contest[problem.contestId].append(problem)
+        return dict(problemset_by_contest)
+
     def problemset_empty(self):
         query = 'SELECT 1 FROM problem2'
         res = self.conn.execute(query).fetchone()